@@ -1,6 +1,35 @@
+import math
+import os
+import re
+import tempfile
+import warnings
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
 import h5py
 import numpy as np
 
+_UNITS = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3, "TB": 1024**4}
+_MEMSPEC_PATTERN = re.compile(r"(\d+)\s*([KMGT]?B)")
+_DEMO_PATTERN = re.compile(r"demo_(\d+)")
+
+# filter id and options of the blosc filter registered by hdf5plugin (LZ4, level 5, byte-shuffle)
+_BLOSC_FILTER_ID = 32001
+_BLOSC_LZ4_OPTS = (0, 0, 0, 0, 5, 1, 1)
+
+# bounds for chunks given in bytes: at least a filesystem block (larger when compressing, so the filters
+# see enough data) and at most the default size of the HDF5 chunk cache
+_MIN_CHUNK_BYTES = 16 * 1024
+_MIN_CHUNK_BYTES_COMPRESSED = 64 * 1024
+_MAX_CHUNK_BYTES = 1024**2
+
+# chunk cache of files opened by the collector: the 1MB default holds only a few chunks, so partially filled chunks
+# get evicted and re-read (and re-compressed) on every append. rdcc_nslots should be a prime ~100x the number of
+# chunks fitting in the cache, rdcc_w0 prefers evicting fully written chunks.
+_RDCC_NBYTES = 64 * 1024**2
+_RDCC_NSLOTS = 10007
+_RDCC_W0 = 0.75
+
 
 def _memspec_to_bytes(memspec: int | str | None) -> int | None:
     if memspec is None:
@@ -8,49 +37,218 @@ def _memspec_to_bytes(memspec: int | str | None) -> int | None:
     if isinstance(memspec, int):
         return memspec
     if isinstance(memspec, str):
-        if memspec.endswith("KB"):
-            return int(memspec[:-2]) * 1024
-        if memspec.endswith("MB"):
-            return int(memspec[:-2]) * 1024**2
-        if memspec.endswith("GB"):
-            return int(memspec[:-2]) * 1024**3
-        if memspec.endswith("TB"):
-            return int(memspec[:-2]) * 1024**4
-        if memspec.endswith("B"):
-            try:
-                return int(memspec[:-1])
-            except ValueError:
-                pass
-        raise ValueError(f"Invalid memory specification: {memspec}")
+        match = _MEMSPEC_PATTERN.fullmatch(memspec)
+        if match is not None:
+            return int(match[1]) * _UNITS[match[2]]
+        try:
+            return int(memspec)
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid memory specification: {memspec}")
+
+
+def _chunk_encoder(dset: h5py.Dataset):
+    """Returns a function applying the filter pipeline of `dset` to a full chunk, or None if it is not supported.
+
+    Supported are uncompressed datasets and gzip with an optional preceding shuffle, for which the chunk can be encoded
+    in-process (zlib releases the GIL) and written with write_direct_chunk, bypassing the chunk cache.
+    """
+    if dset.chunks[1:] != dset.shape[1:] or dset.dtype.kind not in "biufc":
+        return None
+    shuffle, level = False, None
+    dcpl = dset.id.get_create_plist()
+    for i in range(dcpl.get_nfilters()):
+        code, _, values, _ = dcpl.get_filter(i)
+        if code == h5py.h5z.FILTER_SHUFFLE and level is None:
+            shuffle = dset.dtype.itemsize > 1
+        elif code == h5py.h5z.FILTER_DEFLATE:
+            level = values[0]
+        else:
+            return None
+
+    def encode(data: np.ndarray):
+        if shuffle:
+            data = np.ascontiguousarray(data.view(np.uint8).reshape(-1, data.dtype.itemsize).T)
+        if level is not None:
+            return zlib.compress(data, level)
+        return data
+
+    return encode
+
+
+class _BatchBuffer:
+    """Stages the rows of one dataset name, dtype and item shape for all episodes of the batch until full chunks can be
+    written at once.
+
+    The state is stored column-wise (one array per field, indexed by batch slot), so appending a batch is a single
+    vectorized assignment. The capacity of a slot is chosen such that every write ends on a chunk boundary of its
+    dataset. Datasets may be pre-allocated, `length` counts the rows written and `extent` the allocated rows.
+    """
+
+    def __init__(self, dset: h5py.Dataset, data: np.ndarray):
+        batch_size = len(data)
+        self.shape = dset.shape[1:]
+        self.dtype = dset.dtype
+        self.chunks = dset.chunks
+        self.chunk_rows = dset.chunks[0]
+        self.data = data
+        self.dsets = [None] * batch_size
+        self.created = np.zeros(batch_size, dtype=bool)
+        self.num_created = 0
+        self.fill = np.zeros(batch_size, dtype=np.int64)
+        self.capacity = np.full(batch_size, self.chunk_rows, dtype=np.int64)
+        self.length = np.zeros(batch_size, dtype=np.int64)
+        self.extent = np.zeros(batch_size, dtype=np.int64)
+        self._slots = np.arange(batch_size)
+        self._mem_space = h5py.h5s.create_simple(self.data.shape[1:])
+        self._offset = (0,) * len(self.shape)
+        self._encode = _chunk_encoder(dset)
+
+    def attach(self, idx: int, dset: h5py.Dataset) -> None:
+        """Assign the dataset of a new episode to slot `idx`."""
+        self.dsets[idx] = dset
+        self.created[idx] = True
+        self.num_created += 1
+        self.extent[idx] = dset.shape[0]
+
+    def retire(self, idx: np.ndarray) -> None:
+        """Free the slots `idx`, their rows must have been written."""
+        for i in idx:
+            self.dsets[i] = None
+        self.num_created -= np.count_nonzero(self.created[idx])
+        self.created[idx] = False
+        self.fill[idx] = 0
+        self.capacity[idx] = self.chunk_rows
+        self.length[idx] = 0
+        self.extent[idx] = 0
+
+    def append_all(self, data: np.ndarray) -> np.ndarray:
+        """Stage one row for every slot, returns the slots that reached their capacity."""
+        self.data[self._slots, self.fill] = data
+        self.fill += 1
+        return np.flatnonzero(self.fill == self.capacity)
+
+    def append(self, active: np.ndarray, data: np.ndarray) -> np.ndarray:
+        """Stage one row for each slot in `active`, returns the slots that reached their capacity."""
+        fill = self.fill[active]
+        self.data[active, fill] = data
+        fill += 1
+        self.fill[active] = fill
+        return active[fill == self.capacity[active]]
+
+    def pending(self, idx: np.ndarray | None = None) -> np.ndarray:
+        """Returns the slots with staged rows, restricted to `idx` if given."""
+        if idx is None:
+            return np.flatnonzero(self.fill)
+        return idx[self.fill[idx] > 0]
+
+    def encode(self, idx: int) -> np.ndarray | bytes | None:
+        """Encode the rows of slot `idx` for write_direct_chunk, None if they are not a full chunk or not supported."""
+        if self.fill[idx] != self.chunk_rows or self._encode is None:
+            return None
+        return self._encode(self.data[idx])
+
+    def write(self, idx: int, chunk: np.ndarray | bytes | None = None) -> None:
+        """Write the staged rows of slot `idx` to its dataset.
+
+        Args:
+            idx: The batch slot.
+            chunk: The result of `encode` if it was already computed. (default: None = encode here)
+        """
+        fill = int(self.fill[idx])
+        if fill == 0:
+            return
+        if chunk is None:
+            chunk = self.encode(idx)
+        dset = self.dsets[idx]
+        start = int(self.length[idx])
+        length = self.length[idx] = start + fill
+        if length > self.extent[idx]:
+            # grow geometrically, the dataset is truncated to its length when the episode is reset
+            extent = self.extent[idx] = max(length, 2 * int(self.extent[idx]))
+            dset.id.set_extent((extent,) + self.shape)
+        if chunk is not None:
+            # the slot holds exactly one chunk of the dataset
+            dset.id.write_direct_chunk((start,) + self._offset, chunk)
+        else:
+            count = (fill,) + self.shape
+            # select the staged rows and their destination directly and issue a single H5Dwrite,
+            # bypassing the selection machinery of the high-level API
+            self._mem_space.select_hyperslab((0,) + self._offset, count)
+            file_space = dset.id.get_space()
+            file_space.select_hyperslab((start,) + self._offset, count)
+            dset.id.write(self._mem_space, file_space, self.data[idx])
+        self.fill[idx] = 0
+        self.capacity[idx] = self.chunk_rows - length % self.chunk_rows
+
+    def truncate(self, idx: np.ndarray) -> None:
+        """Shrink the datasets of the slots `idx` to the rows written so far."""
+        for i in idx[self.extent[idx] != self.length[idx]]:
+            self.extent[i] = self.length[i]
+            self.dsets[i].id.set_extent((int(self.extent[i]),) + self.shape)
 
 
 class HDF5Collector:
     """Collector interface for episodic data to HDF5 files.
 
+    Rows are staged in memory and written in chunks, call `close` when done (also if an open file was passed in) to
+    write the remaining rows and release the compression threads.
+
     Args:
         file: The HDF5 file to write to.
+            if str/PathLike: Opened in append mode with libver="latest" and a 64MB chunk cache.
+            if h5py.File: Used as is, a warning is emitted if it was not opened with libver="latest".
         batch_size: The batch size.
         chunk: Chunk size for the data.
             if int: Chunk size in number of elements.
-            if str: Chunk size in bytes.
-            if None: Auto-chunking. (default: None)
-        compression: Compression algorithm to use.
+            if str: Chunk size in bytes. Raised to at least 16KB (64KB with compression), rounded up to a power of
+                two rows and capped at 1MB.
+            if None: Chunks of at least 16KB (64KB with compression) along the time axis. (default: None)
+        compression: Compression algorithm to use. All filters except blosc are combined with the shuffle filter.
             if None: No compression. (default: None)
-            options: gzip (best, slow), lzf (good, fast)
+            options: lzf (good, fast), blosc:lz4 (good, fast, requires hdf5plugin), gzip (best, slow)
+            gzip without compression_opts is mapped to lzf, pass a level to opt into gzip (e.g. for archival).
+        compression_opts: Compression level for gzip (0-9), gzip chunks are compressed on a thread pool.
+            (default: None)
+        estimated_length: Expected episode length, datasets are pre-allocated to it and truncated on reset and close.
+            if None: Datasets grow geometrically. (default: None)
+        max_ram: Memory for staging chunks in RAM, further staging buffers are memory-mapped temporary files.
+            if int: Memory in bytes.
+            if str: Memory specification, e.g. "4GB".
+            if None: No limit. (default: None)
     """
 
     def __init__(
         self,
-        file: h5py.File,
+        file: h5py.File | str | os.PathLike,
         batch_size: int = 1,
         chunk: int | str | None = None,
         compression: str | None = None,
+        compression_opts: int | None = None,
+        estimated_length: int | None = None,
+        max_ram: int | str | None = None,
     ):
-        self._file = file
+        if compression_opts is not None and compression != "gzip":
+            raise ValueError(f"compression_opts is only supported with gzip compression, got {compression}")
+        if isinstance(file, h5py.File):
+            if file.id.get_access_plist().get_libver_bounds()[0] != h5py.h5f.LIBVER_LATEST:
+                warnings.warn('File was not opened with libver="latest", appending to datasets may be slow')
+            self._file = file
+            self._owns_file = False
+        else:
+            self._file = h5py.File(
+                file,
+                "a",
+                libver="latest",
+                rdcc_nbytes=_RDCC_NBYTES,
+                rdcc_nslots=_RDCC_NSLOTS,
+                rdcc_w0=_RDCC_W0,
+            )
+            self._owns_file = True
         self._batch_size = batch_size
         if chunk is None:
             self._chunk_info = "auto"
-            self._chunk_data = True
+            self._chunk_size = 0
         else:
             if isinstance(chunk, int):
                 self._chunk_info = "length"
@@ -58,14 +256,33 @@ class HDF5Collector:
             elif isinstance(chunk, str):
                 self._chunk_info = "bytes"
                 self._chunk_size = _memspec_to_bytes(chunk)
+        if compression == "gzip" and compression_opts is None:
+            compression = "lzf"
+        elif compression == "blosc:lz4":
+            try:
+                import hdf5plugin  # noqa: F401 (registers the blosc filter)
+            except ImportError as e:
+                raise ImportError("Compression 'blosc:lz4' requires the hdf5plugin package") from e
+            compression, compression_opts = _BLOSC_FILTER_ID, _BLOSC_LZ4_OPTS
         self._compression = compression
+        self._compression_opts = compression_opts
+        self._shuffle = compression in ("gzip", "lzf")
+        # gzip chunks are compressed in-process, zlib releases the GIL so chunks of different episodes run in parallel
+        self._executor = ThreadPoolExecutor(max_workers=os.cpu_count()) if compression == "gzip" else None
+        self._estimated_length = estimated_length or 0
+        self._max_ram = _memspec_to_bytes(max_ram)
+        self._ram = 0
 
         self._attr_cache = []
-        self._max_id = max([int(key[5:]) for key in self._file.keys() if key.startswith("demo")], default=-1) + 1
-        self._ids = []
-        for _ in range(self._batch_size):
-            self._ids.append(self._max_id)
-            self._max_id += 1
+        self._cache_by_name = {}  # name -> (dtype, item shape) -> _BatchBuffer
+        self._all_indices = np.arange(self._batch_size)
+        self._data_group = self._file.require_group("data")
+        demos = map(_DEMO_PATTERN.fullmatch, self._data_group)
+        self._max_id = max((int(match[1]) for match in demos if match is not None), default=-1) + 1
+        self._ids = [0] * self._batch_size
+        self._demo_prefixes = [""] * self._batch_size
+        self._demo_groups = [None] * self._batch_size
+        self._refresh_ids()
 
     def add(self, name: str, data: np.ndarray, mask: np.ndarray | None = None) -> None:
         """Add a batch of data to the HDF5 file.
@@ -73,38 +290,26 @@ class HDF5Collector:
         Args:
             name: The name of the dataset.
             data: The data to add. Assumes the first axis of the data is the batch axis.
+                Holds either one row per episode or one row per True value in the mask.
             mask: The mask on which episodes to extend. (default: None = all episodes)
         """
-        if len(data) != self._batch_size:
-            if mask is None:
+        if mask is None:
+            if len(data) != self._batch_size:
                 raise ValueError(
                     f"Data batch size ({len(data)}) does not match collector batch size ({self._batch_size})"
                 )
-            else:
-                if not mask.sum() == len(data):
+            self._add_all(name, data)
+        else:
+            active = np.flatnonzero(mask)
+            if len(data) != len(active):
+                if len(data) != self._batch_size:
                     raise ValueError(
-                        f"Data batch size ({len(data)}) is not equal to the number of True values in the mask ({mask.int().sum()})"
+                        f"Data batch size ({len(data)}) is not equal to the number of True values in the mask "
+                        f"({len(active)})"
                     )
-
-        data_group = self._file.require_group("data")
-
-        data_idx = 0
-        for idx, id in enumerate(self._ids):
-            if mask is not None and not mask[idx]:
-                continue
-            key = f"demo_{id}/{name}"
-            if key not in data_group.keys():
-                data_group.create_dataset(
-                    key,
-                    data=data[data_idx : data_idx + 1],
-                    maxshape=(None,) + data.shape[1:],
-                    dtype=data.dtype,
-                    chunks=self.get_chunking(data),
-                    compression=self._compression,
-                )
-            else:
-                data_group[key].resize(data_group[key].shape[0] + 1, axis=0)
-                data_group[key].write_direct(data, np.s_[data_idx], np.s_[-1])
+                data = data[active]
+            if len(active) > 0:
+                self._add_masked(name, data, active)
 
     def add_attribute(self, name: str | None, key: str, value: str, mask: np.ndarray | None) -> None:
         """Add an attribute to the HDF5 file.
@@ -120,50 +325,182 @@ class HDF5Collector:
     def reset(self, mask: np.ndarray | None = None) -> None:
         """Reset the open episodes.
 
+        Only the staged rows of the reset episodes are written, the other episodes keep theirs until their chunks
+        are full.
+
         Args:
             mask: mask of which episodes to reset. (default: None = all episodes)
         """
-        self.flush()
+        self._flush(self._all_indices if mask is None else np.flatnonzero(mask), truncate=True)
         self._refresh_ids(mask)
 
+    def close(self) -> None:
+        """Flush and truncate the open episodes, shut down the compression threads and close the file if the collector
+        opened it.
+
+        Required also when an open file was passed in, the file itself is left open in that case.
+        """
+        self._flush(self._all_indices, truncate=True)
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self._owns_file:
+            self._file.close()
+
     """ UTILS """
 
     def _refresh_ids(self, mask: np.ndarray | None = None) -> np.ndarray:
-        for i in range(self._batch_size):
-            if mask is None or mask[i]:
-                self._ids[i] = self._max_id
-                self._max_id += 1
+        retired = self._all_indices if mask is None else np.flatnonzero(mask)
+        for i in retired:
+            self._ids[i] = self._max_id
+            self._demo_prefixes[i] = f"demo_{self._max_id}"
+            self._demo_groups[i] = None
+            self._max_id += 1
+        for buffers in self._cache_by_name.values():
+            for buffer in buffers.values():
+                buffer.retire(retired)
 
-    def flush(self) -> None:
-        if "data" in self._file.keys():
-            data_dset = self._file["data"]
+    def _add_all(self, name: str, data: np.ndarray) -> None:
+        buffer = self._cache_by_name.get(name, {}).get((data.dtype, data.shape[1:]))
+        if buffer is not None and buffer.num_created == self._batch_size:
+            # every episode already has its dataset in this buffer
+            self._write_rows(buffer, buffer.append_all(data))
         else:
-            data_dset = self._file.create_group("data")
+            self._add_masked(name, data, self._all_indices)
+
+    def _add_masked(self, name: str, data: np.ndarray, active: np.ndarray) -> None:
+        for buffer, owned in self._route(name, data, active):
+            self._write_rows(buffer, buffer.append(active[owned], data[owned]))
+
+    def _route(self, name: str, data: np.ndarray, active: np.ndarray) -> list[tuple[_BatchBuffer, np.ndarray | slice]]:
+        """Split the `active` episodes by the buffer holding their dataset `name`.
+
+        Buffers are keyed by (dtype, item shape). An open episode keeps the item shape of its dataset and rows of
+        another dtype are cast if possible ("same_kind"). New episodes get a dataset with the dtype and item shape of
+        `data`, created with the chunk shape of the matching buffer.
+        """
+        buffers = self._cache_by_name.setdefault(name, {})
+        key = (data.dtype, data.shape[1:])
+        buffer = buffers.get(key)
+        if buffer is not None and buffer.created[active].all():
+            return [(buffer, slice(None))]
+
+        new = np.ones(len(active), dtype=bool)
+        for other in buffers.values():
+            owned = other.created[active]
+            if owned.any():
+                if data.shape[1:] != other.shape or not np.can_cast(data.dtype, other.dtype, "same_kind"):
+                    raise ValueError(
+                        f"Data of '{name}' ({data.shape[1:]}, {data.dtype}) does not match the dataset "
+                        f"({other.shape}, {other.dtype})"
+                    )
+                new &= ~owned
+
+        for idx in active[new]:
+            group = self._demo_groups[idx]
+            if group is None:
+                group = self._demo_groups[idx] = self._data_group.create_group(self._demo_prefixes[idx])
+            dset = group.create_dataset(
+                name,
+                shape=(self._estimated_length,) + data.shape[1:],
+                maxshape=(None,) + data.shape[1:],
+                dtype=data.dtype,
+                chunks=self.get_chunking(data) if buffer is None else buffer.chunks,
+                compression=self._compression,
+                compression_opts=self._compression_opts,
+                shuffle=self._shuffle,
+            )
+            if buffer is None:
+                buffer = buffers[key] = _BatchBuffer(dset, self._allocate(dset.chunks[:1] + dset.shape[1:], dset.dtype))
+            buffer.attach(idx, dset)
+
+        routes = []
+        for other in buffers.values():
+            owned = other.created[active]
+            if owned.all():
+                return [(other, slice(None))]
+            if owned.any():
+                routes.append((other, owned))
+        return routes
+
+    def _get_target(self, name: str | None, idx: int) -> h5py.Group | h5py.Dataset | None:
+        if name is None:
+            return self._demo_groups[idx]
+        for buffer in self._cache_by_name.get(name, {}).values():
+            if buffer.created[idx]:
+                return buffer.dsets[idx]
+        # groups and datasets not staged under `name`, e.g. the parent group of staged datasets
+        group = self._demo_groups[idx]
+        return None if group is None else group.get(name)
+
+    def _allocate(self, slot_shape: tuple, dtype: np.dtype) -> np.ndarray:
+        """Allocate a staging buffer for the whole batch, backed by a temporary file once `max_ram` is exceeded."""
+        shape = (self._batch_size,) + slot_shape
+        nbytes = math.prod(shape) * dtype.itemsize
+        if self._max_ram is not None and self._ram + nbytes > self._max_ram:
+            # the page cache serves the rows to the HDF5 writes without pinning them in RAM
+            return np.memmap(tempfile.TemporaryFile(), mode="w+", shape=shape, dtype=dtype)
+        self._ram += nbytes
+        return np.empty(shape, dtype=dtype)
+
+    def _write_rows(self, buffer: _BatchBuffer, idx: np.ndarray) -> None:
+        # encode on the worker threads, the writes themselves are serialized by HDF5
+        if self._executor is not None and len(idx) > 1:
+            chunks = self._executor.map(buffer.encode, idx)
+        else:
+            chunks = map(buffer.encode, idx)
+        for i, chunk in zip(idx, chunks):
+            buffer.write(i, chunk)
+
+    def flush(self) -> None:
+        """Write the staged rows and cached attributes of all open episodes, their datasets keep the allocated rows."""
+        self._flush()
+
+    def _flush(self, idx: np.ndarray | None = None, truncate: bool = False) -> None:
+        """Write the staged rows of the episodes `idx` and all cached attributes.
+
+        Args:
+            idx: The batch slots to write. (default: None = all episodes)
+            truncate: Shrink the datasets of `idx` to their length, only for episodes that end. (default: False)
+        """
+        for buffers in self._cache_by_name.values():
+            for buffer in buffers.values():
+                self._write_rows(buffer, buffer.pending(idx))
+                if truncate:
+                    buffer.truncate(idx)
 
         if len(self._attr_cache) > 0:
+            # merge the cached attributes per target and resolve each target once, all targets are checked before
+            # any attribute is written
+            attrs = {}
             for name, key, value, mask in self._attr_cache:
-                for idx, id in enumerate(self._ids):
-                    if mask is not None and not mask[idx]:
-                        continue
-                    name = f"demo_{id}/{name}" if name is not None else f"demo_{id}"
-                    if name not in data_dset.keys():
-                        raise ValueError(f"Dataset '{name}' does not exist")
-                    data_dset[name].attrs[key] = value
+                for idx in self._all_indices if mask is None else np.flatnonzero(mask):
+                    attrs.setdefault((name, int(idx)), {})[key] = value
+            targets = {(name, idx): self._get_target(name, idx) for name, idx in attrs}
+            for (name, idx), target in targets.items():
+                if target is None:
+                    path = self._demo_prefixes[idx] if name is None else f"{self._demo_prefixes[idx]}/{name}"
+                    raise ValueError(f"Dataset '{path}' does not exist")
+            for (name, idx), values in attrs.items():
+                targets[(name, idx)].attrs.update(values)
 
         self._file.flush()
 
-        self._data_cache = []
         self._attr_cache = []
-        self._ram = 0
 
     def get_chunking(self, batch):
         item_shape = batch.shape[1:]
-        item_bytes = batch.nbytes // self._batch_size
-        if self._chunk_info == "auto":
-            return True
-        elif self._chunk_info == "length":
+        item_bytes = max(batch.itemsize * math.prod(item_shape), 1)
+        if self._chunk_info == "length":
             return (self._chunk_size,) + item_shape
-        elif self._chunk_info == "bytes":
-            return (max(self._chunk_size // item_bytes, 1),) + item_shape
+        elif self._chunk_info in ("auto", "bytes"):
+            # chunks always span whole items: rows are staged per chunk, so splitting the item dimensions would only
+            # stage more rows without aligning the writes
+            min_bytes = _MIN_CHUNK_BYTES if self._compression is None else _MIN_CHUNK_BYTES_COMPRESSED
+            target_bytes = max(self._chunk_size, min_bytes)
+            if item_bytes > target_bytes and self._chunk_info == "bytes":
+                warnings.warn(f"Item size ({item_bytes}B) exceeds the chunk size ({target_bytes}B), using 1-row chunks")
+            rows = 1 << (max(target_bytes // item_bytes, 1) - 1).bit_length()
+            max_rows = 1 << (max(_MAX_CHUNK_BYTES // item_bytes, 1).bit_length() - 1)
+            return (min(rows, max_rows),) + item_shape
         else:
             raise ValueError(f"Invalid chunk info: {self._chunk_info}")
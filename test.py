@@ -24,7 +24,7 @@ def test_hdf5_collector():
         },
     }
 
-    with h5py.File("test.h5", "w") as file:
+    with h5py.File("test.h5", "w", libver="latest") as file:
         collector = HDF5Collector(file, batch_size=2, chunk="4KB")
         print(collector._ids)  # [0, 1]
 
@@ -66,6 +66,7 @@ def test_hdf5_collector():
         collector.add("b", b_batch, mask=np.array([True, False]))
 
         collector.reset()
+        collector.close()
 
     with h5py.File("test.h5", "r") as file:
 
@@ -87,9 +88,315 @@ def test_hdf5_collector():
                 print(file_data.name, file_data.shape, file_data.dtype)
                 assert gt.shape == file_data.shape, f"Shape mismatch for {demo}/{key}"
                 assert gt.dtype == file_data.dtype, f"Dtype mismatch for {demo}/{key}"
+                assert np.array_equal(gt, file_data[()]), f"Value mismatch for {demo}/{key}"
+
+    print("All tests passed!")
+
+
+def test_compression():
+    import h5py
+    import numpy as np
+
+    for compression, compression_opts, expected in (
+        (None, None, None),
+        ("gzip", None, "lzf"),
+        ("gzip", 4, "gzip"),
+        ("lzf", None, "lzf"),
+    ):
+        with h5py.File("test.h5", "w", libver="latest") as file:
+            collector = HDF5Collector(file, batch_size=1, compression=compression, compression_opts=compression_opts)
+            collector.add("a", np.random.rand(1, 10))
+            collector.close()
+            dset = file["data/demo_0/a"]
+            assert dset.compression == expected, f"Compression mismatch for {compression}"
+            assert dset.shuffle == (expected is not None), f"Shuffle mismatch for {compression}"
+
+    for compression in (None, "lzf"):
+        try:
+            HDF5Collector("test.h5", compression=compression, compression_opts=4)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"compression_opts accepted for {compression}")
+
+    print("All tests passed!")
+
+
+def test_chunking():
+    import h5py
+    import numpy as np
+
+    for chunk, compression, item_shape, expected in (
+        ("4KB", None, (), 2048),
+        ("4KB", "lzf", (), 8192),
+        ("100KB", None, (3,), 8192),
+        ("16MB", None, (), 131072),
+        ("4KB", None, (10000,), 1),
+        (None, None, (), 2048),
+        (None, "lzf", (), 8192),
+        (None, None, (84, 84, 3), 1),
+    ):
+        with h5py.File("test.h5", "w", libver="latest") as file:
+            collector = HDF5Collector(file, batch_size=1, chunk=chunk, compression=compression)
+            collector.add("a", np.zeros((1,) + item_shape))
+            assert file["data/demo_0/a"].chunks == (expected,) + item_shape, f"Chunk mismatch for {chunk}"
+
+    print("All tests passed!")
+
+
+def test_memspec():
+    from collector.hdf5_collector import _memspec_to_bytes
+
+    for memspec, expected in ((None, None), (512, 512), ("1024", 1024), ("4 KB", 4096), ("2GB", 2 * 1024**3)):
+        assert _memspec_to_bytes(memspec) == expected, f"Memory specification mismatch for {memspec!r}"
+    for memspec in ("1.5MB", "4 kB", 1.5, [1024]):
+        try:
+            _memspec_to_bytes(memspec)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"Invalid memory specification {memspec!r} accepted")
+
+    print("All tests passed!")
+
+
+def test_file_path():
+    import os
+
+    import h5py
+    import numpy as np
+
+    data = np.random.rand(2, 10, 3)
+
+    if os.path.exists("test.h5"):
+        os.remove("test.h5")
+
+    collector = HDF5Collector("test.h5", batch_size=2, estimated_length=100)
+    for i in range(10):
+        collector.add("a", data[:, i])
+    collector.close()
+
+    collector = HDF5Collector("test.h5", batch_size=2)
+    assert collector._ids == [2, 3], "Ids of existing demos are reused"
+    collector.close()
+
+    with h5py.File("test.h5", "r") as file:
+        for idx in range(2):
+            assert np.array_equal(file[f"data/demo_{idx}/a"][()], data[idx]), f"Value mismatch for demo_{idx}"
+
+    print("All tests passed!")
+
+
+def test_dtype_change():
+    import h5py
+    import numpy as np
+
+    for chunk in ("4KB", 8):
+        a = np.random.rand(2, 3000)
+        b = np.random.rand(2, 3000).astype(np.float32)
+        c = np.random.rand(1, 3000, 2)
+
+        with h5py.File("test.h5", "w", libver="latest") as file:
+            collector = HDF5Collector(file, batch_size=2, chunk=chunk)
+            for i in range(1000):
+                collector.add("x", a[:, i])
+            collector.reset(np.array([False, True]))
+            for i in range(1000, 3000):
+                collector.add("x", b[:, i])  # demo_0 keeps float64, demo_2 is float32
+            collector.reset(np.array([False, True]))
+            for i in range(3000):
+                collector.add("x", c[:, i], mask=np.array([False, True]))  # demo_3 has a different item shape
+            try:
+                collector.add("x", c[:, 0], mask=np.array([True, False]))
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("Item shape of an open episode changed without error")
+            collector.close()
+
+            assert file["data/demo_0/x"].dtype == np.float64, "Dtype of an open episode changed"
+            assert file["data/demo_2/x"].dtype == np.float32, "Dtype of a new episode is not kept"
+            assert np.array_equal(file["data/demo_0/x"][()], np.concatenate([a[0, :1000], b[0, 1000:]]))
+            assert np.array_equal(file["data/demo_1/x"][()], a[1, :1000])
+            assert np.array_equal(file["data/demo_2/x"][()], b[1, 1000:])
+            assert np.array_equal(file["data/demo_3/x"][()], c[0])
+
+    print("All tests passed!")
+
+
+def test_direct_chunk_roundtrip():
+    import h5py
+    import numpy as np
+
+    data = (np.random.rand(1, 200, 3) * 100).astype(np.float32)
+
+    for compression, compression_opts in ((None, None), ("gzip", 4), ("lzf", None)):
+        with h5py.File("test.h5", "w", libver="latest") as file:
+            collector = HDF5Collector(
+                file, batch_size=1, chunk=16, compression=compression, compression_opts=compression_opts
+            )
+            for i in range(200):
+                collector.add("a", data[:, i])
+                if i == 70:
+                    collector.flush()  # breaks the chunk alignment of the following writes
+            collector.close()
+
+            dset = file["data/demo_0/a"]
+            assert dset.id.get_num_chunks() == 13, f"Chunk count mismatch for {compression}"
+            assert np.array_equal(dset[()], data[0]), f"Value mismatch for {compression}"
+
+    print("All tests passed!")
+
+
+def test_threaded_compression():
+    import h5py
+    import numpy as np
+
+    data = (np.random.rand(4, 100, 5) * 100).astype(np.float32)
+
+    with h5py.File("test.h5", "w", libver="latest") as file:
+        collector = HDF5Collector(file, batch_size=4, chunk=16, compression="gzip", compression_opts=6)
+        assert collector._executor is not None, "No thread pool for gzip"
+        for i in range(100):
+            collector.add("a", data[:, i])  # all four episodes fill a chunk in the same call
+        collector.close()
+
+        for idx in range(4):
+            dset = file[f"data/demo_{idx}/a"]
+            assert dset.compression == "gzip", f"Compression mismatch for demo_{idx}"
+            assert np.array_equal(dset[()], data[idx]), f"Value mismatch for demo_{idx}"
+
+    print("All tests passed!")
+
+
+def test_max_ram():
+    import h5py
+    import numpy as np
+
+    data = np.random.rand(2, 300, 4)
+
+    with h5py.File("test.h5", "w", libver="latest") as file:
+        collector = HDF5Collector(file, batch_size=2, chunk=64, max_ram="1KB")
+        for i in range(300):
+            collector.add("a", data[:, i])
+        (buffer,) = collector._cache_by_name["a"].values()
+        assert isinstance(buffer.data, np.memmap), "Staging buffer above max_ram is not memory-mapped"
+        collector.close()
+
+        for idx in range(2):
+            assert np.array_equal(file[f"data/demo_{idx}/a"][()], data[idx]), f"Value mismatch for demo_{idx}"
+
+    print("All tests passed!")
+
+
+def test_attributes():
+    import h5py
+    import numpy as np
+
+    with h5py.File("test.h5", "w", libver="latest") as file:
+        collector = HDF5Collector(file, batch_size=3)
+        collector.add("a", np.random.rand(3, 2))
+        collector.add("obs/rgb", np.random.rand(3, 2))
+        collector.add_attribute(None, "success", True, None)
+        collector.add_attribute("obs", "camera", "front", None)
+        collector.add_attribute("a", "unit", "m", np.array([True, False, True]))
+        collector.add_attribute("a", "unit", "cm", np.array([False, False, True]))
+        collector.reset()
+
+        for idx in range(3):
+            assert file[f"data/demo_{idx}"].attrs["success"], f"Group attribute missing for demo_{idx}"
+        assert file["data/demo_0/a"].attrs["unit"] == "m", "Dataset attribute mismatch for demo_0"
+        assert "unit" not in file["data/demo_1/a"].attrs, "Masked dataset attribute written for demo_1"
+        assert file["data/demo_2/a"].attrs["unit"] == "cm", "Dataset attribute mismatch for demo_2"
+        for idx in range(3):
+            assert file[f"data/demo_{idx}/obs"].attrs["camera"] == "front", f"Attribute missing for demo_{idx}/obs"
+
+        # demo_4 has no datasets yet, no attribute is written
+        collector.add("a", np.random.rand(2, 2), mask=np.array([True, False, True]))
+        collector.add_attribute(None, "success", False, None)
+        try:
+            collector.flush()
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Attribute of an episode without datasets did not raise")
+        assert "success" not in file["data/demo_3"].attrs, "Attribute written although flush failed"
+
+    print("All tests passed!")
+
+
+def test_masked_reset():
+    import h5py
+    import numpy as np
+
+    data = np.random.rand(3, 40, 2)
+
+    with h5py.File("test.h5", "w", libver="latest") as file:
+        collector = HDF5Collector(file, batch_size=3, chunk=16)
+        for i in range(20):
+            collector.add("a", data[:, i])
+        (buffer,) = collector._cache_by_name["a"].values()
+        collector.reset(np.array([False, True, False]))
+        assert list(buffer.fill) == [4, 0, 4], "Masked reset wrote the staged rows of other episodes"
+        assert file["data/demo_1/a"].shape == (20, 2), "Reset episode not written"
+        for i in range(20, 40):
+            collector.add("a", data[:, i])
+        collector.close()
+
+        for idx in (0, 2):
+            assert np.array_equal(file[f"data/demo_{idx}/a"][()], data[idx]), f"Value mismatch for demo_{idx}"
+        assert np.array_equal(file["data/demo_3/a"][()], data[1, 20:]), "Value mismatch for demo_3"
+
+    print("All tests passed!")
+
+
+def test_estimated_length():
+    import h5py
+    import numpy as np
+
+    data = np.random.rand(2, 10, 3)
+
+    with h5py.File("test.h5", "w", libver="latest") as file:
+        collector = HDF5Collector(file, batch_size=2, chunk=4, estimated_length=1000)
+        for i in range(10):
+            collector.add("a", data[:, i])
+        collector.reset(np.array([True, False]))
+        assert file["data/demo_0/a"].shape == (10, 3), "Reset episode not truncated"
+        assert file["data/demo_1/a"].shape == (1000, 3), "Pre-allocated extent lost on the reset of another episode"
+        collector.flush()
+        assert file["data/demo_1/a"].shape == (1000, 3), "Pre-allocated extent lost on flush"
+        collector.close()
+        assert np.array_equal(file["data/demo_1/a"][()], data[1]), "Open episode not truncated on close"
+
+    print("All tests passed!")
+
+
+def test_libver_warning():
+    import warnings
+
+    import h5py
+
+    for libver, expected in (("earliest", True), (("v110", "latest"), True), ("latest", False)):
+        with h5py.File("test.h5", "w", libver=libver) as file:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                HDF5Collector(file).close()
+            assert any("libver" in str(w.message) for w in caught) == expected, f"Warning mismatch for {libver}"
 
     print("All tests passed!")
 
 
 if __name__ == "__main__":
     test_hdf5_collector()
+    test_compression()
+    test_chunking()
+    test_memspec()
+    test_file_path()
+    test_dtype_change()
+    test_direct_chunk_roundtrip()
+    test_threaded_compression()
+    test_max_ram()
+    test_attributes()
+    test_masked_reset()
+    test_estimated_length()
+    test_libver_warning()